@@ -1,4 +1,7 @@
+import argparse
 import json
+import os
+from contextlib import nullcontext
 import pandas as pd
 from src.teams_sharepoint.auth import AuthManager
 from src.teams_sharepoint.data_fetcher import DataFetcher
@@ -9,6 +12,7 @@ from src.purview.data_processor import PurviewDataProcessor
 from src.scms.data_fetcher import SCMSDataFetcher
 from src.sccm.data_fetcher import SCCMDataFetcher
 from src.common.excel_handler import ExcelHandler
+from src.common.snapshot_store import SnapshotStore
 from src.common.logger import get_logger
 
 logger = get_logger(__name__)
@@ -164,56 +168,94 @@ def process_sccm_data(credentials):
         logger.error(f"Error processing SCCM data: {e}")
         raise
 
-def main():
+def save_output(data_dict, file_path, executor=None):
+    """Save data to a single workbook, or to one workbook per entity when given a process pool."""
+    if executor is not None:
+        output_dir = os.path.splitext(file_path)[0]
+        ExcelHandler.save_sharded(data_dict, output_dir, executor=executor)
+        return output_dir
+    ExcelHandler.save_to_excel(data_dict, file_path)
+    return file_path
+
+def filter_output(input_path, output_file, executor=None):
+    """Filter a saved output based on _Y columns."""
+    if executor is not None:
+        output_dir = os.path.splitext(output_file)[0]
+        ExcelHandler.load_and_filter_sharded(input_path, output_dir, executor=executor)
+        return output_dir
+    ExcelHandler.load_and_filter_excel(input_path, output_file)
+    return output_file
+
+def save_changes(snapshot_store, data_dict, file_path, executor=None):
+    """Diff data against the previous run's snapshot and save only the changed rows."""
+    if snapshot_store is None:
+        return None
+    source_name = os.path.splitext(os.path.basename(file_path))[0]
+    changes, snapshot = snapshot_store.diff(source_name, data_dict)
+    changes_path = save_output(changes, f'{source_name}_changes.xlsx', executor)
+    # Only move the snapshot forward once the changes have been written
+    snapshot_store.save(source_name, snapshot)
+    logger.info(f"Changes since last run saved to '{changes_path}'")
+    return changes_path
+
+def main(sharded=False, track_changes=False, snapshot_dir='snapshots'):
     """Main function to orchestrate the data processing and saving."""
     try:
         logger.info("Starting metadata extraction process...")
 
         credentials = load_credentials()
-
-        # Process Teams and SharePoint data
-        logger.info("Processing Teams and SharePoint data...")
-        teams_sharepoint_data = process_teams_sharepoint_data(credentials)
-        ExcelHandler.save_to_excel(teams_sharepoint_data, 'all_metadata.xlsx')
-        logger.info("Teams and SharePoint data saved to 'all_metadata.xlsx'")
-
-        # Process Purview data
-        logger.info("Processing Purview data...")
-        purview_data = process_purview_data(credentials)
-        ExcelHandler.save_to_excel(purview_data, 'purview_data.xlsx')
-        logger.info("Purview data saved to 'purview_data.xlsx'")
-
-        # Process SCMS data
-        logger.info("Processing SCMS data...")
-        scms_data = process_scms_data(credentials)
-        ExcelHandler.save_to_excel(scms_data, 'blockchain_metadata.xlsx')
-        logger.info("SCMS data saved to 'blockchain_metadata.xlsx'")
-
-        # Process SCCM data
-        logger.info("Processing SCCM data...")
-        sccm_data = process_sccm_data(credentials)
-        ExcelHandler.save_to_excel(sccm_data, 'sccm_data.xlsx')
-        logger.info("SCCM data saved to 'sccm_data.xlsx'")
-
-        # Filter Teams and SharePoint data
-        logger.info("Filtering Teams and SharePoint data...")
-        ExcelHandler.load_and_filter_excel('all_metadata.xlsx', 'filtered_metadata.xlsx')
-        logger.info("Filtered Teams and SharePoint data saved to 'filtered_metadata.xlsx'")
-
-        # Filter Purview data
-        logger.info("Filtering Purview data...")
-        ExcelHandler.load_and_filter_excel('purview_data.xlsx', 'filtered_purview_data.xlsx')
-        logger.info("Filtered Purview data saved to 'filtered_purview_data.xlsx'")
-
-        # Filter SCMS data
-        logger.info("Filtering SCMS data...")
-        ExcelHandler.load_and_filter_excel('blockchain_metadata.xlsx', 'filtered_blockchain_metadata.xlsx')
-        logger.info("Filtered SCMS data saved to 'filtered_blockchain_metadata.xlsx'")
-
-        # Filter SCCM data
-        logger.info("Filtering SCCM data...")
-        ExcelHandler.load_and_filter_excel('sccm_data.xlsx', 'filtered_sccm_data.xlsx')
-        logger.info("Filtered SCCM data saved to 'filtered_sccm_data.xlsx'")
+        snapshot_store = SnapshotStore(snapshot_dir) if track_changes else None
+
+        # One process pool is shared by every sharded write of the run, so
+        # worker start-up is paid once rather than per output
+        with ExcelHandler.create_executor() if sharded else nullcontext() as executor:
+            # Process Teams and SharePoint data
+            logger.info("Processing Teams and SharePoint data...")
+            teams_sharepoint_data = process_teams_sharepoint_data(credentials)
+            teams_sharepoint_output = save_output(teams_sharepoint_data, 'all_metadata.xlsx', executor)
+            save_changes(snapshot_store, teams_sharepoint_data, 'all_metadata.xlsx', executor)
+            logger.info(f"Teams and SharePoint data saved to '{teams_sharepoint_output}'")
+
+            # Process Purview data
+            logger.info("Processing Purview data...")
+            purview_data = process_purview_data(credentials)
+            purview_output = save_output(purview_data, 'purview_data.xlsx', executor)
+            save_changes(snapshot_store, purview_data, 'purview_data.xlsx', executor)
+            logger.info(f"Purview data saved to '{purview_output}'")
+
+            # Process SCMS data
+            logger.info("Processing SCMS data...")
+            scms_data = process_scms_data(credentials)
+            scms_output = save_output(scms_data, 'blockchain_metadata.xlsx', executor)
+            save_changes(snapshot_store, scms_data, 'blockchain_metadata.xlsx', executor)
+            logger.info(f"SCMS data saved to '{scms_output}'")
+
+            # Process SCCM data
+            logger.info("Processing SCCM data...")
+            sccm_data = process_sccm_data(credentials)
+            sccm_output = save_output(sccm_data, 'sccm_data.xlsx', executor)
+            save_changes(snapshot_store, sccm_data, 'sccm_data.xlsx', executor)
+            logger.info(f"SCCM data saved to '{sccm_output}'")
+
+            # Filter Teams and SharePoint data
+            logger.info("Filtering Teams and SharePoint data...")
+            filtered_output = filter_output(teams_sharepoint_output, 'filtered_metadata.xlsx', executor)
+            logger.info(f"Filtered Teams and SharePoint data saved to '{filtered_output}'")
+
+            # Filter Purview data
+            logger.info("Filtering Purview data...")
+            filtered_output = filter_output(purview_output, 'filtered_purview_data.xlsx', executor)
+            logger.info(f"Filtered Purview data saved to '{filtered_output}'")
+
+            # Filter SCMS data
+            logger.info("Filtering SCMS data...")
+            filtered_output = filter_output(scms_output, 'filtered_blockchain_metadata.xlsx', executor)
+            logger.info(f"Filtered SCMS data saved to '{filtered_output}'")
+
+            # Filter SCCM data
+            logger.info("Filtering SCCM data...")
+            filtered_output = filter_output(sccm_output, 'filtered_sccm_data.xlsx', executor)
+            logger.info(f"Filtered SCCM data saved to '{filtered_output}'")
 
         logger.info("Metadata extraction process completed successfully.")
 
@@ -222,4 +264,23 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract metadata from Microsoft services.")
+    parser.add_argument(
+        '--sharded',
+        action='store_true',
+        help="Write each entity to its own workbook in parallel, with an index.json manifest per source."
+    )
+    parser.add_argument(
+        '--changes',
+        action='store_true',
+        help="Also write the rows added, modified or removed since the previous run to <output>_changes.xlsx "
+             "(a <output>_changes/ directory with --sharded). Rows are matched per entity on the key "
+             "columns listed in the README."
+    )
+    parser.add_argument(
+        '--snapshot-dir',
+        default='snapshots',
+        help="Directory holding the entity hashes of the previous run (default: snapshots)."
+    )
+    args = parser.parse_args()
+    main(sharded=args.sharded, track_changes=args.changes, snapshot_dir=args.snapshot_dir)
\ No newline at end of file
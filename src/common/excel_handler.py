@@ -1,11 +1,31 @@
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
-from src.common.logger import get_logger
+from src.common.logger import get_logger, init_worker_logging, worker_logging_initargs
 
 logger = get_logger(__name__)
 
+# Workers are spawned rather than forked: the parent runs the logging listener
+# thread, and forking a multi-threaded process can deadlock.
+_SPAWN_CONTEXT = multiprocessing.get_context('spawn')
+
 class ExcelHandler:
+    @staticmethod
+    def create_executor(max_workers=None):
+        """Create a process pool for sharded output whose workers log through this process."""
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=_SPAWN_CONTEXT,
+            initializer=init_worker_logging,
+            initargs=worker_logging_initargs(_SPAWN_CONTEXT)
+        )
+
     @staticmethod
     def save_to_excel(data_dict, file_path):
         """Save data to an Excel file."""
@@ -20,6 +40,133 @@ class ExcelHandler:
             logger.error(f"Error saving data to Excel: {e}")
             raise
 
+    @staticmethod
+    def _map_in_pool(executor, max_workers, fn, *iterables):
+        """Map fn over the iterables in the given pool, or in a local one if executor is None."""
+        if executor is not None:
+            return list(executor.map(fn, *iterables))
+        with ExcelHandler.create_executor(max_workers) as local_executor:
+            return list(local_executor.map(fn, *iterables))
+
+    @staticmethod
+    def shard_file_name(entity_name):
+        """Build the workbook file name used for an entity in sharded output."""
+        base_name = re.sub(r'[^0-9a-zA-Z]+', '_', str(entity_name)).strip('_').lower()
+        if not base_name:
+            raise ValueError(f"Entity name {entity_name!r} has no characters usable in a file name")
+        return base_name + '.xlsx'
+
+    @staticmethod
+    def write_entity_workbook(entity_name, data, file_path):
+        """Write a single entity to its own workbook and return its manifest entry."""
+        try:
+            df = pd.DataFrame(data)
+            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+                df.to_excel(writer, sheet_name=entity_name, index=False)
+                ExcelHandler.adjust_column_width(writer.sheets[entity_name])
+            logger.info("Entity '%s' saved to %s", entity_name, file_path)
+            return {
+                'entity': entity_name,
+                'file': os.path.basename(file_path),
+                'rows': len(df),
+                'columns': [str(col) for col in df.columns],
+            }
+        except Exception as e:
+            logger.error(f"Error saving entity '{entity_name}' to Excel: {e}")
+            raise
+
+    @staticmethod
+    def save_sharded(data_dict, output_dir, max_workers=None, executor=None):
+        """Save each entity to its own workbook in parallel and write an index manifest.
+
+        Workbooks are written by worker processes, so export time scales with the
+        number of cores rather than the total row count. The manifest
+        (``index.json``) lists every entity with its file name, row count and
+        columns, and is returned as a dict. Pass an executor from
+        create_executor() to reuse one pool across calls; otherwise a pool of
+        max_workers processes is created for this call.
+        """
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            names = list(data_dict.keys())
+            file_names = {}
+            for name in names:
+                file_name = ExcelHandler.shard_file_name(name)
+                if file_name in file_names:
+                    raise ValueError(
+                        f"Entities '{file_names[file_name]}' and '{name}' would both be written to {file_name}"
+                    )
+                file_names[file_name] = name
+            paths = [os.path.join(output_dir, file_name) for file_name in file_names]
+
+            entries = ExcelHandler._map_in_pool(
+                executor,
+                max_workers,
+                ExcelHandler.write_entity_workbook,
+                names,
+                [data_dict[name] for name in names],
+                paths
+            )
+
+            manifest = {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'entities': entries,
+            }
+            manifest_path = os.path.join(output_dir, 'index.json')
+            with open(manifest_path, 'w') as file:
+                json.dump(manifest, file, indent=2)
+
+            logger.info(f"Sharded data saved to {output_dir} ({len(entries)} workbooks)")
+            return manifest
+        except Exception as e:
+            logger.error(f"Error saving sharded data: {e}")
+            raise
+
+    @staticmethod
+    def load_manifest(output_dir):
+        """Load the index manifest of a sharded output directory."""
+        try:
+            with open(os.path.join(output_dir, 'index.json'), 'r') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading manifest from {output_dir}: {e}")
+            raise
+
+    @staticmethod
+    def load_and_filter_sharded(input_dir, output_dir, max_workers=None, executor=None):
+        """Filter every workbook of a sharded output in parallel, writing a new sharded output."""
+        try:
+            manifest = ExcelHandler.load_manifest(input_dir)
+            os.makedirs(output_dir, exist_ok=True)
+            input_paths = [os.path.join(input_dir, entry['file']) for entry in manifest['entities']]
+            output_paths = [os.path.join(output_dir, entry['file']) for entry in manifest['entities']]
+
+            kept_columns = ExcelHandler._map_in_pool(
+                executor, max_workers, ExcelHandler.load_and_filter_excel, input_paths, output_paths
+            )
+
+            filtered_manifest = {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'source': os.path.abspath(input_dir),
+                'entities': [
+                    {
+                        'entity': entry['entity'],
+                        'file': entry['file'],
+                        'rows': entry['rows'],
+                        'columns': columns[entry['entity']],
+                    }
+                    for entry, columns in zip(manifest['entities'], kept_columns)
+                ],
+            }
+            with open(os.path.join(output_dir, 'index.json'), 'w') as file:
+                json.dump(filtered_manifest, file, indent=2)
+
+            logger.info(f"Filtered sharded data saved to {output_dir}")
+            return filtered_manifest
+        except Exception as e:
+            logger.error(f"Error filtering sharded data: {e}")
+            raise
+
     @staticmethod
     def adjust_column_width(sheet):
         """Adjust the column width of the Excel sheet to fit the content."""
@@ -35,7 +182,7 @@ class ExcelHandler:
                         pass
                 adjusted_width = (max_length + 2)
                 sheet.column_dimensions[column_letter].width = adjusted_width
-            logger.info(f"Adjusted column widths for sheet: {sheet.title}")
+            logger.info("Adjusted column widths for sheet: %s", sheet.title)
         except Exception as e:
             logger.error(f"Error adjusting column widths: {e}")
             raise
@@ -71,12 +218,7 @@ class ExcelHandler:
                     df = pd.read_excel(excel_data, sheet_name=sheet_name)
                     filtered_df = ExcelHandler.filter_columns_with_Y(df)
                     filtered_df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-            workbook = load_workbook(output_file)
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                ExcelHandler.adjust_column_width(sheet)
-            workbook.save(output_file)
+                    ExcelHandler.adjust_column_width(writer.sheets[sheet_name])
 
             logger.info(f"Filtered data has been written to '{output_file}'")
         except Exception as e:
@@ -92,20 +234,29 @@ class ExcelHandler:
 
     @staticmethod
     def load_and_filter_excel(input_filename, output_filename):
-        """Load data from Excel, filter based on _Y columns, and save to new Excel file."""
+        """Load data from Excel, filter based on _Y columns, and save to new Excel file.
+
+        Returns a dict of sheet name -> list of the columns kept.
+        """
         try:
             workbook = load_workbook(input_filename)
+            kept_columns = {}
 
             with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
                 for sheetname in workbook.sheetnames:
                     sheet = workbook[sheetname]
                     # Load data into a DataFrame
                     data = pd.DataFrame(sheet.values)
-                    data.columns = data.iloc[0]
-                    data = data[1:]
+                    if data.empty:
+                        # Empty entity (e.g. a failed fetch): keep the sheet as it is
+                        filtered_data = data
+                    else:
+                        data.columns = data.iloc[0]
+                        data = data[1:]
 
-                    # Filter the data
-                    filtered_data = ExcelHandler.filter_columns_with_Y(data)
+                        # Filter the data
+                        filtered_data = ExcelHandler.filter_columns_with_Y(data)
+                    kept_columns[sheetname] = [str(col) for col in filtered_data.columns]
 
                     # Save the filtered data to the new Excel file
                     filtered_data.to_excel(writer, sheet_name=sheetname, index=False)
@@ -114,6 +265,7 @@ class ExcelHandler:
                     ExcelHandler.adjust_column_width(writer.sheets[sheetname])
 
             logger.info(f"Filtered data saved to {output_filename}")
+            return kept_columns
         except Exception as e:
             logger.error(f"Error processing and saving workbook: {e}")
             raise
\ No newline at end of file
@@ -1,11 +1,200 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FILE = 'metadata_fetch.log'
+DEFAULT_LEVEL = logging.INFO
+
+# Levels per subsystem, matched on the longest logger name prefix
+# (e.g. {'src.teams_sharepoint': logging.WARNING}).
+SUBSYSTEM_LEVELS = {}
+
+# Fraction of records kept per message type, keyed by the unformatted message.
+# Only applies below WARNING; warnings and errors are always written.
+SAMPLE_RATES = {
+    'Data fetched from endpoint: %s': 0.01,
+}
+
+_lock = threading.Lock()
+_queue_handler = None
+_file_handler = None
+_listener = None
+_worker_queue = None
+_worker_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'type': getattr(record, 'msg_type', None),
+            'message': record.getMessage(),
+        }
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one in every N records of a message type, as configured in SAMPLE_RATES."""
+
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.set_sample_rates(sample_rates)
+
+    def set_sample_rates(self, sample_rates):
+        # Swapped in with a single assignment so concurrent filter() calls
+        # never see intervals and counters from different configurations.
+        intervals = {msg: max(1, round(1 / rate)) for msg, rate in sample_rates.items() if rate > 0}
+        dropped = {msg for msg, rate in sample_rates.items() if rate <= 0}
+        counters = {msg: count() for msg in intervals}
+        self._state = (intervals, dropped, counters)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not isinstance(record.msg, str):
+            return True
+        intervals, dropped, counters = self._state
+        if record.msg in dropped:
+            return False
+        interval = intervals.get(record.msg)
+        if interval is None:
+            return True
+        return next(counters[record.msg]) % interval == 0
+
+
+class _TemplateQueueHandler(QueueHandler):
+    """QueueHandler that keeps the %-style template of a record as its message type.
+
+    Records logged without arguments (e.g. pre-formatted f-strings) have no
+    template and get no message type.
+    """
+
+    def prepare(self, record):
+        msg_type = record.msg if record.args and isinstance(record.msg, str) else None
+        record = super().prepare(record)
+        record.msg_type = msg_type
+        return record
+
+
+def _level_for(name):
+    matches = [prefix for prefix in SUBSYSTEM_LEVELS if name == prefix or name.startswith(f'{prefix}.')]
+    if not matches:
+        return DEFAULT_LEVEL
+    return SUBSYSTEM_LEVELS[max(matches, key=len)]
+
+
+def _start_listener():
+    """Start the background thread that writes queued records to the log file."""
+    global _file_handler, _listener
+    _file_handler = logging.FileHandler(LOG_FILE, delay=True)
+    _file_handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(_queue_handler.queue, _file_handler)
+    _listener.start()
+
+
+def _stop_listener():
+    global _listener, _worker_listener
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+    if _listener is not None:
+        _listener.stop()
+        _file_handler.close()
+        _listener = None
+
+
+def _set_log_file(log_file):
+    """Point the file handler at another file without touching the queue.
+
+    Records already queued or being written keep flowing; the new file is
+    opened on the next write.
+    """
+    _file_handler.acquire()
+    try:
+        if _file_handler.stream is not None:
+            _file_handler.stream.close()
+            _file_handler.stream = None
+        _file_handler.baseFilename = os.path.abspath(log_file)
+    finally:
+        _file_handler.release()
+
+
+def _get_queue_handler():
+    global _queue_handler
+    with _lock:
+        if _queue_handler is None:
+            _queue_handler = _TemplateQueueHandler(queue.SimpleQueue())
+            _queue_handler.addFilter(SamplingFilter(SAMPLE_RATES))
+            _start_listener()
+            atexit.register(_stop_listener)
+        return _queue_handler
+
+
+def configure_logging(level=None, subsystem_levels=None, sample_rates=None, log_file=None):
+    """Update logging levels, sampling rates or the log file for all loggers.
+
+    Loggers already returned by get_logger pick up the new levels immediately.
+    """
+    global DEFAULT_LEVEL, LOG_FILE
+    if level is not None:
+        DEFAULT_LEVEL = level
+    if subsystem_levels is not None:
+        SUBSYSTEM_LEVELS.update(subsystem_levels)
+    if sample_rates is not None:
+        SAMPLE_RATES.update(sample_rates)
+
+    handler = _get_queue_handler()
+    for log_filter in handler.filters:
+        if isinstance(log_filter, SamplingFilter):
+            log_filter.set_sample_rates(SAMPLE_RATES)
+    if log_file is not None and log_file != LOG_FILE:
+        with _lock:
+            LOG_FILE = log_file
+            _set_log_file(log_file)
+
+    for name, logger in logging.Logger.manager.loggerDict.items():
+        if isinstance(logger, logging.Logger) and handler in logger.handlers:
+            logger.setLevel(_level_for(name))
+
+
+def worker_logging_initargs(mp_context):
+    """Return the initargs for init_worker_logging in a process pool.
+
+    Worker records are sent over a multiprocessing queue to a listener in
+    this process, so they end up in the same file, through the same handler,
+    as the parent's. Workers get the levels and sampling rates configured at
+    the time of the call.
+    """
+    global _worker_queue, _worker_listener
+    _get_queue_handler()
+    with _lock:
+        if _worker_queue is None:
+            _worker_queue = mp_context.Queue()
+            _worker_listener = QueueListener(_worker_queue, _file_handler)
+            _worker_listener.start()
+    return _worker_queue, DEFAULT_LEVEL, dict(SUBSYSTEM_LEVELS), dict(SAMPLE_RATES)
+
+
+def init_worker_logging(log_queue, level, subsystem_levels, sample_rates):
+    """Process pool initializer sending a worker's records to the parent's log file."""
+    handler = _get_queue_handler()
+    with _lock:
+        # The worker never writes the log file itself
+        _stop_listener()
+        handler.queue = log_queue
+    configure_logging(level=level, subsystem_levels=subsystem_levels, sample_rates=sample_rates)
+
 
 def get_logger(name):
     logger = logging.getLogger(name)
     if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
-        file_handler = logging.FileHandler('metadata_fetch.log')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    return logger
\ No newline at end of file
+        logger.setLevel(_level_for(name))
+        logger.addHandler(_get_queue_handler())
+    return logger
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from src.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Columns identifying an entity across runs. Entities not listed here are keyed
+# by Graph/Purview 'id'; SCMS columns carry the sheet suffix added in main.py.
+KEY_COLUMNS = {
+    # One row per processor instance, so multi-socket machines need the DeviceID
+    'Hardware Inventory': ['ComputerName', 'ProcessorDeviceID'],
+    'Software Inventory': ['ComputerName', 'SoftwareName'],
+    'Backup Status': ['ComputerName', 'BackupDateTime'],
+    'Member Metadata': ['id_member'],
+    'Nodes Metadata': ['id_nodes'],
+    'Contracts Metadata': ['id_contracts'],
+}
+DEFAULT_KEY_COLUMNS = ['id']
+
+CHANGE_COLUMN = '_change'
+
+
+class SnapshotStore:
+    """Persist per-entity content hashes between runs and report what changed.
+
+    Each source (e.g. 'all_metadata') is stored as one JSON file mapping
+    entity name -> {'key_columns': [...], 'hashes': {entity key: row hash}}.
+    Diffs are computed by joining the stored hashes against the current ones
+    on the entity key, so only the hashes of the previous run are loaded,
+    never the previous data itself.
+    """
+
+    def __init__(self, store_dir='snapshots'):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _snapshot_path(self, source_name):
+        return os.path.join(self.store_dir, f'{source_name}.json')
+
+    @staticmethod
+    def key_columns_for(entity_name, df):
+        """Return the key columns for an entity, or [] if they are missing from a non-empty frame.
+
+        An empty frame (e.g. after a failed fetch) keeps the configured key
+        columns, so its previous rows are reported as removed by ID.
+        """
+        key_columns = KEY_COLUMNS.get(entity_name, DEFAULT_KEY_COLUMNS)
+        if df.empty or all(col in df.columns for col in key_columns):
+            return key_columns
+        return []
+
+    @staticmethod
+    def content_columns(df):
+        """Columns taken into account for the content hash (excludes the _Y flag columns)."""
+        return sorted((str(col) for col in df.columns if not str(col).endswith('_Y')))
+
+    @staticmethod
+    def normalize_value(value):
+        """Return a dtype-independent form of a cell value for hashing.
+
+        Missing values become None, integral numbers become int and timestamps
+        ISO strings, so a column switching between int and float64 (e.g. when
+        a NULL appears) does not change the hash of untouched rows.
+        """
+        if isinstance(value, dict):
+            return {str(k): SnapshotStore.normalize_value(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [SnapshotStore.normalize_value(v) for v in value]
+        if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+            return None
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        if isinstance(value, (float, np.floating, Decimal)):
+            value = float(value)
+            return int(value) if value.is_integer() else value
+        if isinstance(value, (datetime, date, time)):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def hash_rows(df, key_columns):
+        """Return the entity key and content hash of every row, in row order.
+
+        Rows without usable key columns are keyed by their own content hash, so
+        they can only ever show up as added or removed.
+        """
+        columns = SnapshotStore.content_columns(df)
+        keys = []
+        hashes = []
+        for record in df.rename(columns=str)[columns].to_dict('records'):
+            record = {col: SnapshotStore.normalize_value(value) for col, value in record.items()}
+            payload = json.dumps(record, sort_keys=True, default=str)
+            row_hash = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+            if key_columns:
+                keys.append(json.dumps([record[col] for col in key_columns], default=str))
+            else:
+                keys.append(row_hash)
+            hashes.append(row_hash)
+        return keys, hashes
+
+    def load(self, source_name):
+        """Load the stored hashes of a source, or an empty dict if there is no snapshot yet."""
+        path = self._snapshot_path(source_name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading snapshot {path}: {e}")
+            raise
+
+    def save(self, source_name, snapshot):
+        """Atomically replace the stored hashes of a source."""
+        path = self._snapshot_path(source_name)
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, path)
+            logger.info(f"Snapshot saved to {path}")
+        except Exception as e:
+            logger.error(f"Error saving snapshot {path}: {e}")
+            raise
+
+    @staticmethod
+    def diff_entity(df, row_keys, current_hashes, previous_hashes, previous_key_columns):
+        """Return a frame of added, modified and removed rows for one entity.
+
+        Added and modified rows are taken from the current frame; removed rows
+        only carry the key columns they were stored with, since their data is
+        no longer available (rows diffed by content carry no columns at all).
+        """
+        added = current_hashes.keys() - previous_hashes.keys()
+        removed = previous_hashes.keys() - current_hashes.keys()
+        modified = {
+            key for key in current_hashes.keys() & previous_hashes.keys()
+            if current_hashes[key] != previous_hashes[key]
+        }
+
+        changes = {key: 'added' for key in added}
+        changes.update({key: 'modified' for key in modified})
+
+        frames = []
+        if changes:
+            keys = pd.Series(row_keys, index=df.index)
+            # Duplicate keys keep their last row, matching current_hashes
+            keys = keys[~keys.duplicated(keep='last')]
+            change_types = keys.map(changes).dropna()
+            changed_df = df.loc[change_types.index].copy()
+            changed_df[CHANGE_COLUMN] = change_types.values
+            frames.append(changed_df)
+        if removed:
+            if previous_key_columns:
+                removed_df = pd.DataFrame([json.loads(key) for key in sorted(removed)],
+                                          columns=previous_key_columns)
+            else:
+                removed_df = pd.DataFrame(index=range(len(removed)))
+            removed_df[CHANGE_COLUMN] = 'removed'
+            frames.append(removed_df)
+
+        if not frames:
+            return pd.DataFrame(columns=[CHANGE_COLUMN])
+        return pd.concat(frames, ignore_index=True)
+
+    def diff(self, source_name, data_dict):
+        """Diff every entity of a source against the stored snapshot.
+
+        Returns a tuple (changes, snapshot). changes is a dict of entity name ->
+        DataFrame of changed rows with a '_change' column set to 'added',
+        'modified' or 'removed'; on the first run every row is reported as
+        added. snapshot holds the current hashes and must be passed to save()
+        once the changes have been written, so a failed write is reported again
+        by the next run.
+        """
+        try:
+            previous_snapshot = self.load(source_name)
+            snapshot = {}
+            diffs = {}
+            for entity_name, data in data_dict.items():
+                df = pd.DataFrame(data)
+                key_columns = self.key_columns_for(entity_name, df)
+                if not key_columns:
+                    configured = KEY_COLUMNS.get(entity_name, DEFAULT_KEY_COLUMNS)
+                    logger.warning(f"Key columns {configured} missing from '{entity_name}'; diffing by row content")
+                previous = previous_snapshot.get(entity_name, {'key_columns': key_columns, 'hashes': {}})
+                if previous['key_columns'] != key_columns:
+                    logger.warning(
+                        f"Key columns of '{entity_name}' changed from {previous['key_columns']} to "
+                        f"{key_columns}; all rows will be reported as removed and added"
+                    )
+                row_keys, row_hashes = self.hash_rows(df, key_columns)
+                current_hashes = dict(zip(row_keys, row_hashes))
+                if len(current_hashes) < len(row_keys):
+                    logger.warning(f"Duplicate entity keys in '{entity_name}'; keeping the last row for each")
+                diffs[entity_name] = self.diff_entity(
+                    df, row_keys, current_hashes, previous['hashes'], previous['key_columns']
+                )
+                snapshot[entity_name] = {'key_columns': key_columns, 'hashes': current_hashes}
+                logger.info("%s/%s: %d changed rows", source_name, entity_name, len(diffs[entity_name]))
+            return diffs, snapshot
+        except Exception as e:
+            logger.error(f"Error computing changes for {source_name}: {e}")
+            raise
@@ -54,6 +54,7 @@ class SCCMDataFetcher:
             SELECT
                 v_GS_COMPUTER_SYSTEM.Name0 AS ComputerName,
                 v_GS_PROCESSOR.Name0 AS ProcessorName,
+                v_GS_PROCESSOR.DeviceID0 AS ProcessorDeviceID,
                 v_GS_PROCESSOR.NumberOfCores0 AS NumberOfCores,
                 v_GS_X86_PC_MEMORY.TotalPhysicalMemory0 AS TotalPhysicalMemory
             FROM
@@ -14,7 +14,7 @@ class DataFetcher:
         try:
             response = requests.get(f'{self.base_url}{endpoint}', headers=headers)
             response.raise_for_status()
-            logger.info(f"Data fetched from endpoint: {endpoint}")
+            logger.info("Data fetched from endpoint: %s", endpoint)
             return response.json()
         except requests.exceptions.HTTPError as err:
             logger.error(f"HTTP error occurred while fetching data from {endpoint}: {err}")